@@ -4,35 +4,155 @@ Bybit Trading Bot
 Receives trade decisions from make.com and executes them on Bybit
 """
 
-import json
+import atexit
 import logging
 import os
+import queue
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from decimal import Decimal, ROUND_DOWN
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+from decimal import Decimal, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_UP
+from logging.handlers import QueueHandler, QueueListener
 
-import requests
-from dotenv import load_dotenv
-from pybit.unified_trading import HTTP
+import fastjsonschema
+import orjson
 
-# Load environment variables
-load_dotenv('config.env')
-
-# Configure logging
+# Configure logging (file/console writes happen on a background thread)
+_log_queue = queue.Queue(-1)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('trading.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
+    handlers=[QueueHandler(_log_queue)]
+)
+_log_listener = QueueListener(
+    _log_queue,
+    logging.FileHandler('trading.log'),
+    logging.StreamHandler(sys.stdout)
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
+# Keep-alive pool for the Bybit REST session
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 20
+
+# Instrument metadata (lot size, tick size) changes rarely
+SYMBOL_INFO_TTL = 24 * 60 * 60
+
+# Short-lived balance cache for bursts of trades
+BALANCE_TTL = 2.0
+
+# Fetches the symbol info while the calling thread fetches the balance,
+# when neither is cached; shared so trades don't each start threads
+PREFETCH_WORKERS = 4
+_prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='bybit-prefetch')
+
+# Shape of the "trade" object sent by make.com
+_PRICE = {"type": "number", "exclusiveMinimum": 0}
+_PRICE_LEVEL = {"type": "object", "required": ["price"], "properties": {"price": _PRICE}}
+TRADE_SCHEMA = {
+    "type": "object",
+    "required": ["symbol", "side", "limit_plan", "risk"],
+    "properties": {
+        "symbol": {"type": "string", "minLength": 1},
+        # Matched case-insensitively, like NormalizedTrade.from_order
+        "side": {"type": "string", "pattern": "(?i)^(long|short)$"},
+        "risk": {
+            "type": "object",
+            "properties": {
+                "risk_per_trade_pct": {"type": "number", "exclusiveMinimum": 0, "maximum": 100}
+            }
+        },
+        "limit_plan": {
+            "type": "object",
+            "required": ["orders", "stop_loss", "take_profits", "cancel_if"],
+            "properties": {
+                "orders": {"type": "array", "minItems": 1, "items": _PRICE_LEVEL},
+                "stop_loss": _PRICE,
+                "take_profits": {"type": "array", "items": _PRICE_LEVEL},
+                "cancel_if": {
+                    "type": "object",
+                    "required": ["timeout_min"],
+                    "properties": {"timeout_min": {"type": "number", "minimum": 0}}
+                }
+            }
+        }
+    }
+}
+validate_trade_data = fastjsonschema.compile(TRADE_SCHEMA)
+
+def _round_to_step(value: float, step: Optional[str], rounding: str) -> Decimal:
+    """Round value to a whole multiple of an exchange step ('0.5', '0.001'), or leave it if unknown"""
+    value = Decimal(str(value))
+    if not step:
+        return value
+    step = Decimal(step)
+    return (value / step).to_integral_value(rounding=rounding) * step
+
+def _stop_rounding(side: str) -> str:
+    """Round stops toward the entry so the realized risk never exceeds the sized risk"""
+    return ROUND_CEILING if side.lower() == "long" else ROUND_FLOOR
+
+@dataclass(frozen=True)
+class NormalizedTrade:
+    """Order fields converted to Bybit's request format once per trade"""
+    bybit_symbol: str
+    entry_side: str
+    qty_str: str
+    price_str: str
+    sl_str: Optional[str]
+    tp_str: Optional[str]
+    
+    @classmethod
+    def from_order(cls, symbol: str, side: str, qty: float, price: float,
+                   stop_loss: float, take_profits: list,
+                   symbol_info: Optional[Dict[str, Any]] = None) -> 'NormalizedTrade':
+        """Build from make.com values (HYPE/USDT, long/short, floats)
+        
+        With symbol_info, quantities are rounded down to a multiple of
+        qtyStep and prices to a multiple of tickSize (stop loss toward
+        the entry, everything else to the nearest tick).
+        """
+        symbol_info = symbol_info or {}
+        qty_step = symbol_info.get('lotSizeFilter', {}).get('qtyStep')
+        tick_size = symbol_info.get('priceFilter', {}).get('tickSize')
+        
+        def to_tick(value: float, rounding: str = ROUND_HALF_UP) -> str:
+            return format(_round_to_step(value, tick_size, rounding), 'f')
+        
+        return cls(
+            # Convert symbol format (HYPE/USDT -> HYPEUSDT)
+            bybit_symbol=symbol.replace('/', ''),
+            # Convert side to derivatives format
+            entry_side="Buy" if side.lower() == "long" else "Sell",
+            qty_str=format(_round_to_step(qty, qty_step, ROUND_DOWN), 'f'),
+            price_str=to_tick(price),
+            sl_str=to_tick(stop_loss, _stop_rounding(side)) if stop_loss else None,
+            # Use the first take profit for simplicity
+            tp_str=to_tick(take_profits[0]['price']) if take_profits else None
+        )
+
 class BybitTrader:
-    def __init__(self):
-        """Initialize Bybit trader with API credentials"""
+    def __init__(self, pool_maxsize: int = HTTP_POOL_MAXSIZE):
+        """Initialize Bybit trader with API credentials
+        
+        pool_maxsize should cover the number of threads calling the
+        trader at once, or extra connections get closed after each use.
+        """
+        # Imported here so scripts that only need the module's helpers
+        # don't pay for loading pybit/requests at import time
+        from dotenv import load_dotenv
+        from pybit.unified_trading import HTTP
+        from requests.adapters import HTTPAdapter
+        
+        # Load environment variables
+        load_dotenv('config.env')
+        
         self.api_key = os.getenv('BYBIT_API_KEY')
         self.secret_key = os.getenv('BYBIT_SECRET_KEY')
         self.testnet = os.getenv('BYBIT_TESTNET', 'false').lower() == 'true'
@@ -47,136 +167,174 @@ class BybitTrader:
             api_secret=self.secret_key
         )
         
-        logger.info(f"Bybit trader initialized (testnet: {self.testnet})")
+        # Reuse keep-alive connections across calls instead of re-doing TLS.
+        # No urllib3 retries here: pybit retries itself, and replaying an
+        # order POST could duplicate it.
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=pool_maxsize)
+        self.session.client.mount('https://', adapter)
+        
+        # symbol -> (fetched_at, instrument info)
+        self._symbol_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        # (fetched_at, USDT wallet balance)
+        self._balance_cache: Tuple[float, float] = (0.0, 0.0)
+        
+        logger.info("Bybit trader initialized (testnet: %s)", self.testnet)
     
-    def get_account_info(self) -> Dict[str, Any]:
-        """Get account information"""
+    def get_account_info(self, coin: Optional[str] = None) -> Dict[str, Any]:
+        """Get account information, optionally limited to one coin"""
         try:
-            response = self.session.get_wallet_balance(accountType="UNIFIED")
+            params = {'accountType': 'UNIFIED'}
+            if coin:
+                params['coin'] = coin
+            response = self.session.get_wallet_balance(**params)
             return response
         except Exception as e:
-            logger.error(f"Failed to get account info: {e}")
+            logger.error("Failed to get account info: %s", e)
             return {}
     
+    def get_usdt_balance(self) -> Optional[float]:
+        """Get USDT wallet balance (cached briefly), or None if it can't be fetched"""
+        usdt_balance = self._cached_usdt_balance()
+        if usdt_balance is not None:
+            return usdt_balance
+        
+        # Ask for the USDT row only instead of every asset in the account
+        account_info = self.get_account_info(coin="USDT")
+        if not account_info or 'result' not in account_info:
+            return None
+        
+        usdt_balance = next(
+            (float(coin['walletBalance'])
+             for account in account_info['result']['list']
+             for coin in account.get('coin', [])
+             if coin['coin'] == 'USDT'),
+            0.0
+        )
+        
+        self._balance_cache = (time.time(), usdt_balance)
+        return usdt_balance
+    
+    def _cached_usdt_balance(self) -> Optional[float]:
+        """USDT balance if the cached value is still fresh, else None"""
+        fetched_at, usdt_balance = self._balance_cache
+        if time.time() - fetched_at < BALANCE_TTL:
+            return usdt_balance
+        return None
+    
+    def _cached_symbol_info(self, symbol: str) -> Optional[Dict[str, Any]]:
+        """Symbol info if the cached value is still fresh, else None"""
+        cached = self._symbol_cache.get(symbol.replace('/', ''))
+        if cached and time.time() - cached[0] < SYMBOL_INFO_TTL:
+            return cached[1]
+        return None
+    
     def get_symbol_info(self, symbol: str) -> Dict[str, Any]:
-        """Get symbol information including tick size and lot size"""
+        """Get symbol information including tick size and lot size (cached)"""
+        bybit_symbol = symbol.replace('/', '')
+        cached = self._cached_symbol_info(bybit_symbol)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.session.get_instruments_info(
                 category="linear",
-                symbol=symbol.replace('/', '')
+                symbol=bybit_symbol
             )
             if response['result']['list']:
-                return response['result']['list'][0]
+                info = response['result']['list'][0]
+                self._symbol_cache[bybit_symbol] = (time.time(), info)
+                return info
             return {}
         except Exception as e:
-            logger.error(f"Failed to get symbol info for {symbol}: {e}")
+            logger.error("Failed to get symbol info for %s: %s", symbol, e)
             return {}
     
-    def calculate_position_size(self, risk_pct: float, stop_loss: float, entry_price: float, symbol_info: Dict[str, Any]) -> float:
-        """Calculate position size based on risk percentage"""
+    def calculate_position_size(self, risk_pct: float, stop_loss: float, entry_price: float, symbol_info: Dict[str, Any],
+                                usdt_balance: Optional[float] = None) -> float:
+        """Calculate position size based on risk percentage (fetches the balance if not given)"""
         try:
-            # Get account balance
-            account_info = self.get_account_info()
-            if not account_info or 'result' not in account_info:
+            # Get USDT balance
+            if usdt_balance is None:
+                usdt_balance = self.get_usdt_balance()
+            if usdt_balance is None:
                 logger.error("Failed to get account balance")
                 return 0.0
             
-            # Find USDT balance
-            usdt_balance = 0.0
-            for account in account_info['result']['list']:
-                if 'coin' in account:
-                    for coin in account['coin']:
-                        if coin['coin'] == 'USDT':
-                            usdt_balance = float(coin['walletBalance'])
-                            break
-            
             if usdt_balance == 0.0:
                 logger.error("No USDT balance found")
                 return 0.0
             
+            # Work in Decimal so lot-size rounding lands exactly on the step
+            entry = Decimal(str(entry_price))
+            
             # Calculate risk amount
-            risk_amount = usdt_balance * (risk_pct / 100)
+            risk_amount = Decimal(str(usdt_balance)) * Decimal(str(risk_pct)) / 100
             
             # Calculate position size based on stop loss distance
-            stop_distance = abs(entry_price - stop_loss)
+            stop_distance = abs(entry - Decimal(str(stop_loss)))
             if stop_distance == 0:
                 logger.error("Invalid stop loss distance")
                 return 0.0
             
-            position_size = risk_amount / stop_distance
-            
-            # Round down to meet lot size requirements
+            # Round down to a whole number of lot steps
             lot_size_filter = symbol_info.get('lotSizeFilter', {})
-            min_order_qty = float(lot_size_filter.get('minOrderQty', 0.001))
-            qty_step = float(lot_size_filter.get('qtyStep', 0.001))
+            min_order_qty = Decimal(str(lot_size_filter.get('minOrderQty', '0.001')))
+            qty_step = Decimal(str(lot_size_filter.get('qtyStep', '0.001')))
             
-            position_size = (position_size // qty_step) * qty_step
-            position_size = max(position_size, min_order_qty)
+            steps = (risk_amount / stop_distance / qty_step).to_integral_value(rounding=ROUND_DOWN)
+            position_size = max(steps * qty_step, min_order_qty)
             
             # Ensure minimum order value of 5 USDT for derivatives
-            min_order_value = 5.0
-            min_position_size = min_order_value / entry_price
-            if position_size * entry_price < min_order_value:
-                position_size = min_position_size
-                # Round up to meet minimum order value
-                position_size = ((position_size // qty_step) + 1) * qty_step
-                position_size = max(position_size, min_order_qty)
+            min_order_value = Decimal('5')
+            if position_size * entry < min_order_value:
+                # Round up to the first step that meets the minimum order value
+                min_steps = (min_order_value / entry / qty_step).to_integral_value(rounding=ROUND_CEILING)
+                position_size = max(min_steps * qty_step, min_order_qty)
             
-            logger.info(f"Calculated position size: {position_size} (risk: {risk_pct}%, balance: {usdt_balance} USDT, order value: {position_size * entry_price:.2f} USDT)")
-            return position_size
+            logger.info("Calculated position size: %s (risk: %s%%, balance: %s USDT, order value: %.2f USDT)",
+                        float(position_size), risk_pct, usdt_balance, position_size * entry)
+            return float(position_size)
             
         except Exception as e:
-            logger.error(f"Failed to calculate position size: {e}")
+            logger.error("Failed to calculate position size: %s", e)
             return 0.0
     
     def place_limit_order(self, symbol: str, side: str, qty: float, price: float, 
-                         stop_loss: float, take_profits: list, timeout_min: int = 120) -> Dict[str, Any]:
+                         stop_loss: float, take_profits: list, timeout_min: int = 120,
+                         symbol_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Place a limit order with stop loss and take profits using TP/SL parameters"""
+        # pybit raises this for any non-zero retCode it doesn't retry
+        from pybit.exceptions import InvalidRequestError
+        
         try:
-            # Convert symbol format (HYPE/USDT -> HYPEUSDT)
-            bybit_symbol = symbol.replace('/', '')
-            
-            # Convert side to derivatives format
-            derivatives_side = "Buy" if side.lower() == "long" else "Sell"
-            
-            # Prepare TP/SL parameters
-            tp_sl_params = {}
-            
-            # Add stop loss
-            if stop_loss:
-                tp_sl_params['stopLoss'] = str(stop_loss)
-            
-            # Add take profits (use the first one for simplicity)
-            if take_profits and len(take_profits) > 0:
-                tp_sl_params['takeProfit'] = str(take_profits[0]['price'])
+            order = NormalizedTrade.from_order(symbol, side, qty, price, stop_loss, take_profits, symbol_info)
             
             # Place the main limit order with TP/SL
             order_params = {
                 'category': 'linear',
-                'symbol': bybit_symbol,
-                'side': derivatives_side,
+                'symbol': order.bybit_symbol,
+                'side': order.entry_side,
                 'orderType': 'Limit',
-                'qty': str(qty),
-                'price': str(price),
+                'qty': order.qty_str,
+                'price': order.price_str,
                 'timeInForce': 'GTC'
             }
             
             # Add TP/SL parameters if available
-            order_params.update(tp_sl_params)
+            if order.sl_str:
+                order_params['stopLoss'] = order.sl_str
+            if order.tp_str:
+                order_params['takeProfit'] = order.tp_str
             
             order_response = self.session.place_order(**order_params)
             
-            if order_response['retCode'] != 0:
-                logger.error(f"Failed to place limit order: {order_response}")
-                return order_response
-            
             order_id = order_response['result']['orderId']
-            logger.info(f"Placed {side} limit order: {order_id} for {qty} {symbol} at {price}")
+            logger.info("Placed %s limit order: %s for %s %s at %s", side, order_id, order.qty_str, symbol, order.price_str)
             
-            if stop_loss:
-                logger.info(f"Stop loss set at: {stop_loss}")
-            if take_profits:
-                logger.info(f"Take profit set at: {take_profits[0]['price']}")
+            if order.sl_str:
+                logger.info("Stop loss set at: %s", order.sl_str)
+            if order.tp_str:
+                logger.info("Take profit set at: %s", order.tp_str)
             
             return {
                 'success': True,
@@ -185,37 +343,51 @@ class BybitTrader:
                 'take_profits': take_profits
             }
             
+        except InvalidRequestError as e:
+            logger.error("Limit order rejected: %s (ErrCode: %s)", e.message, e.status_code)
+            return {'success': False, 'error': e.message, 'error_code': e.status_code}
         except Exception as e:
-            logger.error(f"Failed to place orders: {e}")
+            logger.error("Failed to place orders: %s", e)
             return {'success': False, 'error': str(e)}
     
     def execute_trade(self, trade_data: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a trade based on the received trade decision"""
         try:
-            logger.info(f"Executing trade: {trade_data['symbol']} {trade_data['side']}")
-            
             # Validate trade data
-            required_fields = ['symbol', 'side', 'limit_plan', 'risk']
-            for field in required_fields:
-                if field not in trade_data:
-                    return {'success': False, 'error': f'Missing required field: {field}'}
+            try:
+                validate_trade_data(trade_data)
+            except fastjsonschema.JsonSchemaValueException as e:
+                return {'success': False, 'error': f'Invalid trade data: {e.message}'}
+            
+            logger.info("Executing trade: %s %s", trade_data['symbol'], trade_data['side'])
             
             symbol = trade_data['symbol']
             side = trade_data['side']
             limit_plan = trade_data['limit_plan']
             risk = trade_data['risk']
             
-            # Get symbol information
-            symbol_info = self.get_symbol_info(symbol)
+            # Get symbol information and USDT balance; usually at least one
+            # is cached, and only two network fetches are worth overlapping
+            if self._cached_symbol_info(symbol) is None and self._cached_usdt_balance() is None:
+                symbol_future = _prefetch_executor.submit(self.get_symbol_info, symbol)
+                usdt_balance = self.get_usdt_balance()
+                symbol_info = symbol_future.result()
+            else:
+                symbol_info = self.get_symbol_info(symbol)
+                usdt_balance = self.get_usdt_balance()
+            
             if not symbol_info:
                 return {'success': False, 'error': f'Failed to get symbol info for {symbol}'}
+            if usdt_balance is None:
+                return {'success': False, 'error': 'Failed to get account balance'}
             
-            # Calculate position size
-            entry_price = limit_plan['orders'][0]['price']
-            stop_loss = limit_plan['stop_loss']
+            # Calculate position size from the prices that will actually be sent
+            tick_size = symbol_info.get('priceFilter', {}).get('tickSize')
+            entry_price = float(_round_to_step(limit_plan['orders'][0]['price'], tick_size, ROUND_HALF_UP))
+            stop_loss = float(_round_to_step(limit_plan['stop_loss'], tick_size, _stop_rounding(side)))
             risk_pct = risk.get('risk_per_trade_pct', 0.4)
             
-            position_size = self.calculate_position_size(risk_pct, stop_loss, entry_price, symbol_info)
+            position_size = self.calculate_position_size(risk_pct, stop_loss, entry_price, symbol_info, usdt_balance)
             if position_size == 0.0:
                 return {'success': False, 'error': 'Failed to calculate position size'}
             
@@ -227,25 +399,31 @@ class BybitTrader:
                 price=entry_price,
                 stop_loss=stop_loss,
                 take_profits=limit_plan['take_profits'],
-                timeout_min=limit_plan['cancel_if']['timeout_min']
+                timeout_min=limit_plan['cancel_if']['timeout_min'],
+                symbol_info=symbol_info
             )
             
             if result['success']:
-                logger.info(f"Trade executed successfully: {symbol} {side} {position_size} at {entry_price}")
+                logger.info("Trade executed successfully: %s %s %s at %s", symbol, side, position_size, entry_price)
             else:
-                logger.error(f"Trade execution failed: {result.get('error', 'Unknown error')}")
+                logger.error("Trade execution failed: %s", result.get('error', 'Unknown error'))
             
             return result
             
         except Exception as e:
-            logger.error(f"Failed to execute trade: {e}")
+            logger.error("Failed to execute trade: %s", e)
             return {'success': False, 'error': str(e)}
 
+@lru_cache(maxsize=1)
+def get_trader() -> BybitTrader:
+    """Return the process-wide trader so its HTTP session (and caches) are reused"""
+    return BybitTrader()
+
 def main():
     """Main function to handle incoming trade decisions"""
     try:
         # Initialize trader
-        trader = BybitTrader()
+        trader = get_trader()
         
         # For testing, you can load the trade data from a file or pass it as input
         # In production, this would come from your webhook endpoint
@@ -255,7 +433,7 @@ def main():
         user_input = input().strip()
         
         if user_input:
-            trade_data = json.loads(user_input)
+            trade_data = orjson.loads(user_input)
         else:
             # Use sample data for testing
             trade_data = {
@@ -285,7 +463,7 @@ def main():
         
         if result['success']:
             print("✅ Trade executed successfully!")
-            print(json.dumps(result, indent=2))
+            print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
         else:
             print("❌ Trade execution failed!")
             print(f"Error: {result.get('error', 'Unknown error')}")
@@ -293,7 +471,7 @@ def main():
     except KeyboardInterrupt:
         print("\n👋 Trading bot stopped by user")
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         print(f"❌ Error: {e}")
 
 if __name__ == "__main__":
@@ -5,7 +5,7 @@ Shows the bot functionality without requiring account balance
 """
 
 import json
-from bybit_trader import BybitTrader
+from bybit_trader import get_trader
 
 def demo_bot_functionality():
     """Demonstrate the bot's core functionality"""
@@ -14,7 +14,7 @@ def demo_bot_functionality():
         print("=" * 50)
         
         # Initialize trader
-        trader = BybitTrader()
+        trader = get_trader()
         print("✅ Trader initialized successfully")
         
         # Test account connection
@@ -16,7 +16,7 @@ echo "🔧 Activating virtual environment..."
 source venv/bin/activate
 
 # Check if dependencies are installed
-if ! python -c "import pybit, requests, dotenv" 2>/dev/null; then
+if ! python -c "import pybit, requests, dotenv, orjson, fastjsonschema" 2>/dev/null; then
     echo "📦 Installing dependencies..."
     pip install -r requirements.txt
 fi
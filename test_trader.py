@@ -4,9 +4,9 @@ Test script for Bybit Trading Bot
 Tests the trader with sample data to ensure everything works correctly
 """
 
-import json
 import sys
-from bybit_trader import BybitTrader
+import orjson
+from bybit_trader import get_trader
 
 def test_trader():
     """Test the trader with sample data"""
@@ -14,7 +14,7 @@ def test_trader():
         print("🧪 Testing Bybit Trading Bot...")
         
         # Initialize trader
-        trader = BybitTrader()
+        trader = get_trader()
         print("✅ Trader initialized successfully")
         
         # Test account info
@@ -126,7 +126,7 @@ def test_sample_trade():
         }
         
         print("📋 Sample trade data structure:")
-        print(json.dumps(sample_trade, indent=2))
+        print(orjson.dumps(sample_trade, option=orjson.OPT_INDENT_2).decode())
         
         print("\n✅ Sample trade data is valid and ready for testing")
         return True
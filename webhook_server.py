@@ -4,32 +4,124 @@ Webhook Server for Bybit Trading Bot
 Receives trade decisions from make.com and executes them
 """
 
-import json
+import atexit
 import logging
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
+import queue
+import signal
+import socket
+import subprocess
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import threading
 import time
-from typing import Dict, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, Any, Optional
 
+import fastjsonschema
+import orjson
 from dotenv import load_dotenv
-from bybit_trader import BybitTrader
+from bybit_trader import HTTP_POOL_MAXSIZE, PREFETCH_WORKERS, TRADE_SCHEMA, BybitTrader
 
 # Load environment variables
 load_dotenv('config.env')
 load_dotenv()  # Also load from .env file
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('webhook.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging. Importing bybit_trader already set up the root logger
+# (console + trading.log), so basicConfig here would be a no-op; webhook
+# records additionally go to webhook.log via a background thread.
+_webhook_log_handler = logging.FileHandler('webhook.log')
+_webhook_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, _webhook_log_handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
+logger.addHandler(QueueHandler(_log_queue))
+
+# make.com envelope around the trade; the trade itself must also satisfy
+# what BybitTrader.execute_trade needs, plus a non-empty take-profit list
+WEBHOOK_SCHEMA = {
+    "type": "object",
+    "required": ["intent", "trade"],
+    "properties": {
+        "intent": {"const": "trade_decision"},
+        "trade": {
+            "allOf": [
+                TRADE_SCHEMA,
+                {
+                    "required": ["action"],
+                    "properties": {
+                        "limit_plan": {"properties": {"take_profits": {"minItems": 1}}}
+                    }
+                }
+            ]
+        }
+    }
+}
+validate_webhook_payload = fastjsonschema.compile(WEBHOOK_SCHEMA)
+
+class BoundedExecutor:
+    """Thread pool that rejects work instead of queueing it without limit"""
+    
+    def __init__(self, max_workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='trade')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+    
+    def submit(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """Schedule fn(*args, **kwargs), or return None if the pool and its queue are full"""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+    
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work and optionally wait for queued trades to finish"""
+        self._executor.shutdown(wait=wait)
+
+# Trades run on a fixed pool; when it's saturated webhooks get a 503 so
+# make.com retries instead of the process piling up threads
+TRADE_WORKERS = int(os.getenv('TRADE_WORKERS', '8'))
+EXECUTOR = BoundedExecutor(
+    max_workers=TRADE_WORKERS,
+    max_pending=int(os.getenv('TRADE_QUEUE_SIZE', '32'))
+)
+
+# make.com trade decisions are a few KB; anything far larger is rejected
+# before it is read or parsed
+MAX_BODY_SIZE = 64 * 1024
+
+# Responses are compact JSON; set DEBUG_PRETTY_JSON=true to indent them
+# when inspecting the server by hand
+RESPONSE_JSON_OPTION = orjson.OPT_INDENT_2 if os.getenv('DEBUG_PRETTY_JSON', 'false').lower() == 'true' else 0
+
+# Health probes hit this often and it never changes
+HEALTH_BODY = orjson.dumps(
+    {"status": "healthy", "service": "Bybit Trading Bot Webhook"},
+    option=RESPONSE_JSON_OPTION
+)
+
+class WebhookHTTPServer(ThreadingHTTPServer):
+    """Thread-per-connection HTTP server with room for bursts of webhooks"""
+    
+    # Listen backlog; the socketserver default of 5 drops connections when a
+    # burst arrives faster than handler threads are started
+    request_queue_size = 64
+
+class ReusePortHTTPServer(WebhookHTTPServer):
+    """WebhookHTTPServer that lets several worker processes share one port"""
+    
+    def server_bind(self):
+        # On Linux the kernel spreads incoming connections across every
+        # socket bound to the port with SO_REUSEPORT (BSD/macOS don't)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
 
 class TradingWebhookHandler(BaseHTTPRequestHandler):
     """HTTP request handler for trading webhooks"""
@@ -40,153 +132,140 @@ class TradingWebhookHandler(BaseHTTPRequestHandler):
     
     def do_POST(self):
         """Handle POST requests with trade decisions"""
+        # One clock read per request, shared by whichever response goes out
+        received_at = time.time()
         try:
             # Get content length
-            content_length = int(self.headers.get('Content-Length', 0))
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                self.send_error_response(400, "Invalid Content-Length", received_at)
+                return
             
-            if content_length == 0:
-                self.send_error_response(400, "No content received")
+            if content_length <= 0:
+                self.send_error_response(400, "No content received", received_at)
+                return
+            
+            if content_length > MAX_BODY_SIZE:
+                logger.error("Rejected webhook body of %s bytes", content_length)
+                self.send_error_response(413, "Payload too large", received_at)
                 return
             
             # Read request body
             post_data = self.rfile.read(content_length)
             
             try:
-                trade_data = json.loads(post_data.decode('utf-8'))
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON received: {e}")
-                self.send_error_response(400, "Invalid JSON format")
+                trade_data = orjson.loads(post_data)
+            except orjson.JSONDecodeError as e:
+                logger.error("Invalid JSON received: %s", e)
+                self.send_error_response(400, "Invalid JSON format", received_at)
                 return
             
             # Log received data
-            logger.info(f"Received webhook: {json.dumps(trade_data, indent=2)}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Received webhook: %s", orjson.dumps(trade_data, option=orjson.OPT_INDENT_2).decode())
             
             # Validate webhook data
             if not self.validate_webhook_data(trade_data):
-                self.send_error_response(400, "Invalid webhook data format")
+                self.send_error_response(400, "Invalid webhook data format", received_at)
                 return
             
-            # Execute trade in background thread
+            # Execute trade on the worker pool
             if self.trader:
-                threading.Thread(
-                    target=self.execute_trade_async,
-                    args=(trade_data,),
-                    daemon=True
-                ).start()
+                if EXECUTOR.submit(self.execute_trade_async, trade_data) is None:
+                    logger.error("Trade queue is full, rejecting webhook")
+                    self.send_error_response(503, "Server busy, retry later", received_at)
+                    return
                 
                 # Send immediate response
                 self.send_success_response({
                     "status": "accepted",
                     "message": "Trade decision received and queued for execution",
-                    "timestamp": time.time()
+                    "timestamp": received_at
                 })
             else:
-                self.send_error_response(500, "Trader not initialized")
+                self.send_error_response(500, "Trader not initialized", received_at)
                 
         except Exception as e:
-            logger.error(f"Error processing webhook: {e}")
-            self.send_error_response(500, f"Internal server error: {str(e)}")
+            logger.error("Error processing webhook: %s", e)
+            self.send_error_response(500, "Internal server error", received_at)
+    
+    def handle_health(self):
+        """Respond to health checks"""
+        self.send_success_body(HEALTH_BODY)
+    
+    # GET path -> handler; add routes here
+    GET_ROUTES = {
+        '/health': handle_health
+    }
     
     def do_GET(self):
-        """Handle GET requests for health checks"""
-        if self.path == '/health':
-            self.send_success_response({
-                "status": "healthy",
-                "timestamp": time.time(),
-                "service": "Bybit Trading Bot Webhook"
-            })
+        """Dispatch GET requests by path"""
+        route = self.GET_ROUTES.get(self.path)
+        if route:
+            route(self)
         else:
             self.send_error_response(404, "Not found")
     
     def validate_webhook_data(self, data: Dict[str, Any]) -> bool:
         """Validate the structure of received webhook data"""
         try:
-            # Check required top-level fields
-            if 'intent' not in data or data['intent'] != 'trade_decision':
-                logger.error("Missing or invalid 'intent' field")
-                return False
-            
-            if 'trade' not in data:
-                logger.error("Missing 'trade' field")
-                return False
-            
-            trade = data['trade']
-            required_trade_fields = ['action', 'symbol', 'side', 'limit_plan', 'risk']
-            
-            for field in required_trade_fields:
-                if field not in trade:
-                    logger.error(f"Missing required trade field: {field}")
-                    return False
-            
-            # Validate limit plan structure
-            limit_plan = trade['limit_plan']
-            if 'orders' not in limit_plan or 'stop_loss' not in limit_plan or 'take_profits' not in limit_plan:
-                logger.error("Invalid limit_plan structure")
-                return False
-            
-            # Validate orders
-            if not limit_plan['orders'] or not isinstance(limit_plan['orders'], list):
-                logger.error("Invalid orders structure")
-                return False
-            
-            # Validate take profits
-            if not limit_plan['take_profits'] or not isinstance(limit_plan['take_profits'], list):
-                logger.error("Invalid take_profits structure")
-                return False
-            
+            validate_webhook_payload(data)
             return True
-            
-        except Exception as e:
-            logger.error(f"Error validating webhook data: {e}")
+        except fastjsonschema.JsonSchemaValueException as e:
+            logger.error("Invalid webhook data: %s", e.message)
             return False
     
     def execute_trade_async(self, trade_data: Dict[str, Any]):
         """Execute trade asynchronously"""
         try:
-            logger.info(f"Executing trade asynchronously: {trade_data['trade']['symbol']}")
+            logger.info("Executing trade asynchronously: %s", trade_data['trade']['symbol'])
             
             result = self.trader.execute_trade(trade_data['trade'])
             
             if result['success']:
-                logger.info(f"Trade executed successfully: {result}")
+                logger.info("Trade executed successfully: %s", result)
             else:
-                logger.error(f"Trade execution failed: {result}")
+                logger.error("Trade execution failed: %s", result)
                 
         except Exception as e:
-            logger.error(f"Error in async trade execution: {e}")
+            logger.error("Error in async trade execution: %s", e)
     
     def send_success_response(self, data: Dict[str, Any]):
         """Send successful response"""
+        self.send_success_body(orjson.dumps(data, option=RESPONSE_JSON_OPTION))
+    
+    def send_success_body(self, body: bytes):
+        """Send successful response with an already serialized JSON body"""
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
-        
-        response = json.dumps(data, indent=2)
-        self.wfile.write(response.encode('utf-8'))
+        self.wfile.write(body)
     
-    def send_error_response(self, status_code: int, message: str):
-        """Send error response"""
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        
+    def send_error_response(self, status_code: int, message: str, timestamp: Optional[float] = None):
+        """Send error response (timestamp defaults to now)"""
         error_data = {
             "error": True,
             "message": message,
             "status_code": status_code,
-            "timestamp": time.time()
+            "timestamp": timestamp if timestamp is not None else time.time()
         }
+        body = orjson.dumps(error_data, option=RESPONSE_JSON_OPTION)
         
-        response = json.dumps(error_data, indent=2)
-        self.wfile.write(response.encode('utf-8'))
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
     
     def log_message(self, format, *args):
         """Override to use our logger instead of stderr"""
-        logger.info(f"{self.address_string()} - {format % args}")
+        logger.info("%s - %s", self.address_string(), format % args)
 
 def create_webhook_handler(trader: BybitTrader):
     """Create a webhook handler with the trader instance"""
@@ -194,41 +273,91 @@ def create_webhook_handler(trader: BybitTrader):
         return TradingWebhookHandler(*args, trader=trader, **kwargs)
     return handler
 
-def run_webhook_server(host: str = '0.0.0.0', port: int = 8080):
-    """Run the webhook server"""
+def run_webhook_server(host: str = '0.0.0.0', port: int = 8080, reuse_port: bool = False):
+    """Run the webhook server (reuse_port lets other worker processes bind the same port)"""
+    server = None
     try:
         # Initialize trader
-        trader = BybitTrader()
+        # One shared trader (and HTTPS keep-alive pool) for all workers. At
+        # most every trade worker plus every symbol-info prefetch thread is
+        # talking to Bybit at once.
+        trader = BybitTrader(pool_maxsize=max(HTTP_POOL_MAXSIZE, TRADE_WORKERS + PREFETCH_WORKERS))
         logger.info("Bybit trader initialized successfully")
         
-        # Create server with custom handler
+        # Create server with custom handler; each connection gets its own
+        # thread so a slow client can't stall other webhooks
         handler = create_webhook_handler(trader)
-        server = HTTPServer((host, port), handler)
+        server_class = ReusePortHTTPServer if reuse_port else WebhookHTTPServer
+        server = server_class((host, port), handler)
         
-        logger.info(f"Webhook server started on {host}:{port}")
+        logger.info("Webhook server started on %s:%s", host, port)
         logger.info("Ready to receive trade decisions from make.com")
-        logger.info("Health check available at: http://localhost:{port}/health")
+        logger.info("Health check available at: http://localhost:%s/health", port)
         
         # Start server
         server.serve_forever()
         
     except KeyboardInterrupt:
         logger.info("Shutting down webhook server...")
-        server.shutdown()
+        if server:
+            server.shutdown()
+        EXECUTOR.shutdown(wait=True)
     except Exception as e:
-        logger.error(f"Failed to start webhook server: {e}")
+        logger.error("Failed to start webhook server: %s", e)
         raise
 
+def _handle_sigterm(signum, frame):
+    """Treat SIGTERM (kill, supervisor stop) like Ctrl+C so cleanup runs
+    
+    Only the first one counts; a repeat would abort the graceful drain.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
 def main():
     """Main function to run the webhook server"""
     # Get configuration from environment or use defaults
     host = os.getenv('WEBHOOK_HOST', '0.0.0.0')
     port = int(os.getenv('PORT', os.getenv('WEBHOOK_PORT', '8080')))
+    workers = int(os.getenv('WEBHOOK_WORKERS', '1'))
     
-    logger.info(f"Starting Bybit Trading Bot Webhook Server...")
-    logger.info(f"Host: {host}, Port: {port}")
-    
-    run_webhook_server(host, port)
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    children = []
+    try:
+        logger.info("Starting Bybit Trading Bot Webhook Server...")
+        logger.info("Host: %s, Port: %s", host, port)
+        
+        if workers > 1 and not (sys.platform.startswith('linux') and hasattr(socket, 'SO_REUSEPORT')):
+            logger.warning("SO_REUSEPORT load balancing is Linux-only, running a single worker")
+            workers = 1
+        
+        # Extra workers are fresh interpreters rather than forks, so each
+        # gets its own logging threads, trade pool and Bybit session. They
+        # inherit WEBHOOK_WORKERS (to enable port sharing) but must not
+        # start workers of their own. They run in their own session so a
+        # terminal Ctrl+C reaches only this process, which then stops them.
+        if workers > 1 and os.getenv('WEBHOOK_WORKER_CHILD') != '1':
+            env = dict(os.environ, WEBHOOK_WORKER_CHILD='1')
+            for _ in range(workers - 1):
+                children.append(subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__)],
+                    env=env,
+                    start_new_session=True
+                ))
+            logger.info("Started %s extra worker processes", len(children))
+        
+        run_webhook_server(host, port, reuse_port=workers > 1)
+    finally:
+        # Children finish their queued trades on SIGTERM; don't leave them
+        # holding the port if they hang
+        for child in children:
+            child.terminate()
+        for child in children:
+            try:
+                child.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                child.kill()
+                child.wait()
 
 if __name__ == "__main__":
     main()